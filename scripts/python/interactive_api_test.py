@@ -4,20 +4,20 @@ Interactive KiotViet API Test Script
 Allows user to input retailer name and tests API endpoints
 """
 
-import requests
+import asyncio
 import json
-from datetime import datetime
+import orjson
 import os
 from dotenv import load_dotenv
-import jwt
+from kiotviet_common import KiotVietClient, MAX_CONCURRENT_REQUESTS, parse_json, read_page
 import base64
 
 # Load environment variables
 load_dotenv()
 
-class InteractiveKiotVietAPI:
+class InteractiveKiotVietAPI(KiotVietClient):
     def __init__(self):
-        self.base_url = "https://public.kiotapi.com"
+        super().__init__()
         
         # Get credentials from environment
         raw_client_id = os.getenv('CLIENT_ID', '')
@@ -25,12 +25,16 @@ class InteractiveKiotVietAPI:
         
         self.client_id = raw_client_id.strip().strip('"').strip("'")
         self.secret_key = raw_secret_key.strip().strip('"').strip("'")
-        self.access_token = None
         
         print(f"🔑 Loaded credentials - Client ID: {self.client_id[:10]}...")
         
     def authenticate(self):
         """Authenticate using the KiotViet OAuth2 endpoint"""
+        if self._use_cached_token():
+            print("✅ Using cached access token")
+            self.try_decode_token()
+            return True
+        
         auth_url = "https://id.kiotviet.vn/connect/token"
         
         auth_data = {
@@ -46,15 +50,16 @@ class InteractiveKiotVietAPI:
         
         try:
             print("🔄 Authenticating...")
-            response = requests.post(auth_url, data=auth_data, headers=headers)
+            response = self.session.post(auth_url, data=auth_data, headers=headers)
             
             if response.status_code == 200:
-                auth_response = response.json()
-                self.access_token = auth_response.get('access_token')
+                auth_response = parse_json(response)
+                self._set_access_token(auth_response.get('access_token'))
                 expires_in = auth_response.get('expires_in')
                 
                 print("✅ Authentication successful!")
                 print(f"⏰ Token expires in: {expires_in} seconds ({expires_in/3600:.1f} hours)")
+                self._save_token(expires_in)
                 
                 # Try to decode the JWT token to extract retailer information
                 self.try_decode_token()
@@ -71,29 +76,27 @@ class InteractiveKiotVietAPI:
     
     def try_decode_token(self):
         """Try to decode JWT token to extract potential retailer information"""
+        # Diagnostic output only; opt in with KIOTVIET_DEBUG_TOKEN=1
+        if not os.getenv('KIOTVIET_DEBUG_TOKEN'):
+            return
+        
         try:
             # JWT tokens are typically in the format: header.payload.signature
             # We can decode the payload (middle part) to see the claims
             token_parts = self.access_token.split('.')
             if len(token_parts) == 3:
-                # Add padding if necessary
+                # JWTs use the URL-safe base64 alphabet without padding
                 payload = token_parts[1]
-                payload += '=' * (4 - len(payload) % 4)
-                
-                # Decode base64
-                decoded_bytes = base64.b64decode(payload)
-                decoded_str = decoded_bytes.decode('utf-8')
-                token_data = json.loads(decoded_str)
+                payload += '=' * (-len(payload) % 4)
+                token_data = json.loads(base64.urlsafe_b64decode(payload))
                 
                 print("\n🔍 Token Information:")
-                interesting_claims = ['sub', 'aud', 'iss', 'client_id', 'scope', 'retailer', 'shop_name', 'name']
-                for claim in interesting_claims:
-                    if claim in token_data:
-                        print(f"   {claim}: {token_data[claim]}")
-                
-                # Look for any claim that might contain retailer/shop info
+                interesting_claims = {'sub', 'aud', 'iss', 'client_id', 'scope', 'retailer', 'shop_name', 'name'}
                 for key, value in token_data.items():
-                    if any(keyword in key.lower() for keyword in ['retail', 'shop', 'store', 'merchant']):
+                    if key in interesting_claims:
+                        print(f"   {key}: {value}")
+                    # Look for any claim that might contain retailer/shop info
+                    elif any(keyword in key.lower() for keyword in ('retail', 'shop', 'store', 'merchant')):
                         print(f"   📍 Found potential shop info - {key}: {value}")
                         
                 print()
@@ -120,48 +123,58 @@ class InteractiveKiotVietAPI:
         print(f"✅ Using retailer name: '{retailer_name}'")
         return retailer_name
     
-    def test_single_endpoint(self, endpoint, name, retailer_name, params=None):
-        """Test a single endpoint with the given retailer name"""
+    def _fetch_endpoint(self, endpoint, retailer_name, params=None):
+        """GET an endpoint without printing anything; returns (status, data, error)"""
         url = f"{self.base_url}{endpoint}"
         
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json',
-            'Retailer': retailer_name
-        }
+        # Authorization and Content-Type live on the session; only the retailer varies per call
+        headers = {'Retailer': retailer_name} if retailer_name else None
         
         try:
-            print(f"🔄 Testing {name} ({endpoint})")
-            response = requests.get(url, headers=headers, params=params)
+            # Stream the body so an ignored pageSize can't pull a whole dataset into memory
+            # (KiotViet pages default to 20 items when pageSize isn't sent)
+            response = self._get(url, headers=headers, params=params, stream=True)
             
             if response.status_code == 200:
-                data = response.json()
-                print(f"✅ {name}: SUCCESS!")
-                
-                # Show data summary
-                if isinstance(data, dict) and 'data' in data:
-                    items_count = len(data['data']) if data['data'] else 0
-                    total = data.get('total', 'unknown')
-                    print(f"   📊 Found {items_count} items (total: {total})")
-                    
-                    if items_count > 0:
-                        # Show sample item structure
-                        sample_item = data['data'][0]
-                        print(f"   📋 Sample item keys: {list(sample_item.keys()) if isinstance(sample_item, dict) else 'Not a dict'}")
-                
-                return data
-                
-            else:
-                print(f"❌ {name}: FAILED (Status: {response.status_code})")
-                error_msg = response.text[:200] + "..." if len(response.text) > 200 else response.text
-                print(f"   Error: {error_msg}")
-                return None
+                return 200, read_page(response, (params or {}).get('pageSize', 20)), None
+            
+            error_msg = response.text[:200] + "..." if len(response.text) > 200 else response.text
+            return response.status_code, None, error_msg
                 
         except Exception as e:
-            print(f"❌ {name}: ERROR - {str(e)}")
-            return None
+            return None, None, str(e)
+    
+    def _report_endpoint(self, name, status, data, error):
+        """Print the result of one endpoint test; returns the data on success"""
+        if status == 200:
+            print(f"✅ {name}: SUCCESS!")
+            
+            # Show data summary
+            if isinstance(data, dict) and 'data' in data:
+                items_count = len(data['data']) if data['data'] else 0
+                total = data.get('total', 'unknown')
+                print(f"   📊 Found {items_count} items (total: {total})")
+                
+                if items_count > 0:
+                    # Show sample item structure
+                    sample_item = data['data'][0]
+                    print(f"   📋 Sample item keys: {list(sample_item.keys()) if isinstance(sample_item, dict) else 'Not a dict'}")
+            
+            return data
+        
+        if status is None:
+            print(f"❌ {name}: ERROR - {error}")
+        else:
+            print(f"❌ {name}: FAILED (Status: {status})")
+            print(f"   Error: {error}")
+        return None
     
-    def test_all_endpoints(self, retailer_name):
+    async def _fetch(self, semaphore, endpoint, retailer_name, params):
+        """Run _fetch_endpoint off the event loop, bounded by the semaphore"""
+        async with semaphore:
+            return await asyncio.to_thread(self._fetch_endpoint, endpoint, retailer_name, params)
+    
+    async def test_all_endpoints(self, retailer_name):
         """Test all available endpoints"""
         print(f"\n🧪 Testing all endpoints with retailer: '{retailer_name}'")
         print("="*60)
@@ -179,8 +192,18 @@ class InteractiveKiotVietAPI:
         
         successful_endpoints = {}
         
-        for endpoint, name, params in endpoints:
-            data = self.test_single_endpoint(endpoint, name, retailer_name, params)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        results = await asyncio.gather(
+            *[self._fetch(semaphore, endpoint, retailer_name, params)
+              for endpoint, name, params in endpoints],
+            return_exceptions=True
+        )
+        
+        # Report in endpoint order once every probe has finished
+        for (endpoint, name, params), result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                result = (None, None, str(result))
+            data = self._report_endpoint(name, *result)
             if data:
                 successful_endpoints[name] = data
             print()
@@ -197,7 +220,8 @@ class InteractiveKiotVietAPI:
             print("❌ No data retrieved. Cannot create dashboard suggestions.")
             return
         
-        dashboard_components = []
+        # Dict as an insertion-ordered set: no duplicates, stable output order
+        dashboard_components = {}
         
         for endpoint_name, data in successful_data.items():
             print(f"\n📈 {endpoint_name} Analysis:")
@@ -210,38 +234,38 @@ class InteractiveKiotVietAPI:
                 print(f"   • Sample data structure: {list(sample_item.keys()) if isinstance(sample_item, dict) else 'Unknown'}")
                 
                 # Suggest dashboard components based on endpoint
-                if 'Products' in endpoint_name:
-                    dashboard_components.extend([
+                if endpoint_name == 'Products':
+                    dashboard_components.update(dict.fromkeys([
                         "📦 Product Inventory Dashboard - Track stock levels, low inventory alerts",
                         "💰 Product Performance - Best/worst selling products, price analysis",
                         "📊 Category Analysis - Products by category, category performance"
-                    ])
-                elif 'Orders' in endpoint_name:
-                    dashboard_components.extend([
+                    ]))
+                elif endpoint_name == 'Orders':
+                    dashboard_components.update(dict.fromkeys([
                         "🛒 Sales Dashboard - Order trends, daily/monthly sales",
                         "📈 Revenue Analytics - Sales performance over time",
                         "🎯 Order Status Tracking - Pending, completed, cancelled orders"
-                    ])
-                elif 'Customers' in endpoint_name:
-                    dashboard_components.extend([
+                    ]))
+                elif endpoint_name == 'Customers':
+                    dashboard_components.update(dict.fromkeys([
                         "👥 Customer Analytics - Customer segmentation, purchase patterns",
                         "🔄 Customer Retention - Repeat customers, customer lifetime value",
                         "📍 Geographic Analysis - Customer distribution by location"
-                    ])
-                elif 'Invoices' in endpoint_name:
-                    dashboard_components.extend([
+                    ]))
+                elif endpoint_name == 'Invoices':
+                    dashboard_components.update(dict.fromkeys([
                         "💳 Financial Dashboard - Revenue, profit margins, payment status",
                         "📋 Invoice Management - Outstanding invoices, payment tracking"
-                    ])
-                elif 'Branches' in endpoint_name:
-                    dashboard_components.extend([
+                    ]))
+                elif endpoint_name == 'Branches':
+                    dashboard_components.update(dict.fromkeys([
                         "🏢 Multi-Branch Analytics - Performance comparison across locations",
                         "📊 Branch Performance - Sales by branch, inventory distribution"
-                    ])
+                    ]))
         
         print(f"\n🎨 RECOMMENDED DASHBOARD COMPONENTS:")
         print("="*60)
-        for i, component in enumerate(set(dashboard_components), 1):
+        for i, component in enumerate(dashboard_components, 1):
             print(f"{i}. {component}")
         
         # Sample data preview
@@ -251,10 +275,10 @@ class InteractiveKiotVietAPI:
             if isinstance(data, dict) and 'data' in data and data['data']:
                 print(f"\n{endpoint_name} - Sample Item:")
                 sample = data['data'][0]
-                formatted_sample = json.dumps(sample, indent=2, ensure_ascii=False)[:500]
-                print(formatted_sample + ("..." if len(str(sample)) > 500 else ""))
+                formatted_sample = orjson.dumps(sample, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+                print(formatted_sample[:500] + ("..." if len(formatted_sample) > 500 else ""))
 
-def main():
+async def main():
     print("🚀 Interactive KiotViet API Explorer")
     print("="*60)
     
@@ -272,7 +296,7 @@ def main():
         return
     
     # Test endpoints
-    successful_data = api.test_all_endpoints(retailer_name)
+    successful_data = await api.test_all_endpoints(retailer_name)
     
     # Analyze for dashboard
     api.analyze_data_for_dashboard(successful_data)
@@ -281,4 +305,4 @@ def main():
     print(f"📊 {len(successful_data)} endpoints returned data successfully.")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -4,18 +4,29 @@ KiotViet API Test Script
 Test various GET endpoints to understand available data for dashboard creation
 """
 
-import requests
-import json
-from datetime import datetime
+import asyncio
+import orjson
 import os
 from dotenv import load_dotenv
+from kiotviet_common import KiotVietClient, MAX_CONCURRENT_REQUESTS, parse_json, read_page
 
 # Load environment variables
 load_dotenv()
 
-class KiotVietAPI:
+# Endpoints rejected with 401/403 before any request succeeds, after which probing stops;
+# retrying won't fix credentials
+MAX_AUTH_FAILURES = 2
+
+class PageRequestError(RuntimeError):
+    """A page request in iter_endpoint failed; cursor points at the page to retry"""
+    def __init__(self, cursor, status):
+        super().__init__(f"Request for {cursor[0]} failed at currentItem={cursor[1]} (status: {status})")
+        self.cursor = cursor
+        self.status = status
+
+class KiotVietAPI(KiotVietClient):
     def __init__(self):
-        self.base_url = "https://public.kiotapi.com"
+        super().__init__()
         
         # Debug: Check raw environment variables
         raw_client_id = os.getenv('CLIENT_ID', '')
@@ -29,12 +40,18 @@ class KiotVietAPI:
         print(f"Cleaned CLIENT_ID: '{self.client_id}'")
         print(f"Cleaned SECRET_KEY: '{self.secret_key}'")
         
-        self.access_token = None
         self.retailer_id = None
+        self._last_status = None
+        self._auth_failures = 0
+        self._auth_ok = False
         
     def authenticate(self):
         """Authenticate using the correct KiotViet OAuth2 endpoint"""
         
+        if self._use_cached_token():
+            print("✅ Using cached access token")
+            return True
+        
         # Correct authentication endpoint from documentation
         auth_url = "https://id.kiotviet.vn/connect/token"
         
@@ -58,12 +75,12 @@ class KiotVietAPI:
         
         try:
             print(f"Making request to: {auth_url}")
-            response = requests.post(auth_url, data=auth_data, headers=headers)
+            response = self.session.post(auth_url, data=auth_data, headers=headers)
             print(f"Auth response status: {response.status_code}")
             
             if response.status_code == 200:
-                auth_response = response.json()
-                self.access_token = auth_response.get('access_token')
+                auth_response = parse_json(response)
+                self._set_access_token(auth_response.get('access_token'))
                 token_type = auth_response.get('token_type')
                 expires_in = auth_response.get('expires_in')
                 
@@ -72,6 +89,8 @@ class KiotVietAPI:
                 print(f"Expires in: {expires_in} seconds")
                 print(f"Access token (first 20 chars): {self.access_token[:20]}...")
                 
+                self._save_token(expires_in)
+                
                 return True
             else:
                 print(f"❌ Authentication failed: {response.status_code}")
@@ -82,50 +101,132 @@ class KiotVietAPI:
             print(f"❌ Authentication error: {str(e)}")
             return False
     
-    def make_request(self, endpoint, params=None, retailer_name=None):
-        """Make authenticated GET request to API endpoint"""
+    def make_request(self, endpoint, params=None, retailer_name=None, max_items=None):
+        """Make authenticated GET request to API endpoint, streaming at most max_items items if given"""
+        status, data, error = self._request(endpoint, params, retailer_name, max_items)
+        self._last_status = status
+        self._report_request(endpoint, retailer_name, status, error)
+        return data
+    
+    def _request(self, endpoint, params, retailer_name, max_items):
+        """Perform the GET without printing; returns (status code or None, data or None, error text)"""
         if not self.access_token:
-            print("❌ No access token. Please authenticate first.")
-            return None
+            return None, None, "No access token. Please authenticate first."
             
         url = f"{self.base_url}{endpoint}"
         
-        # Use correct headers as per documentation
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Add retailer header if provided (we'll try without it first)
-        if retailer_name:
-            headers['Retailer'] = retailer_name
+        # Authorization and Content-Type live on the session; only the retailer varies per call
+        # (we'll try without it first)
+        headers = {'Retailer': retailer_name} if retailer_name else None
         
         try:
-            print(f"🔄 Making request to: {endpoint}")
-            if retailer_name:
-                print(f"Using retailer: {retailer_name}")
-                
-            response = requests.get(url, headers=headers, params=params)
-            print(f"Response status: {response.status_code}")
+            response = self._get(url, headers=headers, params=params, stream=max_items is not None)
             
             if response.status_code == 200:
-                print("✅ Request successful!")
-                return response.json()
-            else:
-                print(f"❌ Request failed: {response.status_code}")
-                print(f"Response: {response.text[:500]}")
-                
-                # If we get a 400/401 and didn't try with retailer header, suggest that
-                if response.status_code in [400, 401] and not retailer_name:
-                    print("💡 Tip: You may need to provide a 'Retailer' header with your store name")
-                
-                return None
+                return 200, read_page(response, max_items) if max_items is not None else parse_json(response), None
+            return response.status_code, None, response.text[:500]
                 
         except Exception as e:
-            print(f"❌ Request error: {str(e)}")
-            return None
+            return None, None, str(e)
+    
+    def _report_request(self, endpoint, retailer_name, status, error):
+        """Print the outcome of one _request call"""
+        print(f"🔄 Making request to: {endpoint}")
+        if retailer_name:
+            print(f"Using retailer: {retailer_name}")
+        
+        if status is None:
+            print(f"❌ Request error ({endpoint}): {error}")
+            return
+        
+        print(f"Response status ({endpoint}): {status}")
+        if status == 200:
+            print(f"✅ Request successful: {endpoint}")
+        else:
+            print(f"❌ Request failed ({endpoint}): {status}")
+            print(f"Response: {error}")
+            
+            # If we get a 400/401 and didn't try with retailer header, suggest that
+            if status in [400, 401] and not retailer_name:
+                print("💡 Tip: You may need to provide a 'Retailer' header with your store name")
+    
+    def iter_endpoint(self, endpoint, page_size=100, retailer_name=None, cursor=None):
+        """Yield (cursor, items) for each page of a paginated endpoint, one page in memory at a time.
+        
+        cursor is (endpoint, currentItem) just past the yielded page; pass it back as cursor
+        to resume after that page. No state is kept on the instance, so separate walks can
+        run side by side. A failed page raises PageRequestError carrying the cursor to retry.
+        
+        Example - count every product, resuming after an interruption:
+        
+            try:
+                for cursor, items in api.iter_endpoint('/products'):
+                    count += len(items)
+            except PageRequestError as e:
+                ...  # later: api.iter_endpoint('/products', cursor=e.cursor)
+        """
+        if cursor and cursor[0] != endpoint:
+            raise ValueError(f"Cursor {cursor} belongs to {cursor[0]}, not {endpoint}")
+        
+        retailer_name = retailer_name or self.retailer_id
+        current = cursor[1] if cursor else 0
+        
+        while True:
+            params = {'pageSize': page_size, 'currentItem': current}
+            status, data, error = self._request(endpoint, params, retailer_name, None)
+            self._report_request(endpoint, retailer_name, status, error)
+            if data is None:
+                raise PageRequestError((endpoint, current), status)
+            
+            items = data.get('data') or []
+            current += len(items)
+            yield (endpoint, current), items
+            
+            if not items or current >= data.get('total', 0):
+                break
     
-    def test_endpoints(self):
+    def _discover_retailer(self):
+        """Find a working Retailer header once, using a cheap single-item /branches request"""
+        # Try without retailer first, then common retailer names in case one works
+        potential_retailers = [None, 'taphoaxyz', 'store', 'shop', self.client_id[:10]]
+        
+        # A wrong Retailer header can also produce 401, so only the endpoint as a whole
+        # counts as an auth failure, once every candidate has been rejected
+        all_rejected = True
+        for retailer in potential_retailers:
+            print(f"\n--- Trying {'without retailer' if not retailer else f'with retailer: {retailer}'} ---")
+            if self.make_request('/branches', {'pageSize': 1}, retailer, max_items=1):
+                self.retailer_id = retailer
+                print(f"✅ Using retailer: {retailer or '(none)'}")
+                return True
+            all_rejected = all_rejected and self._last_status in (401, 403)
+        
+        if all_rejected:
+            self._auth_failures += 1
+        print("❌ No retailer option worked for /branches")
+        return False
+    
+    async def _fetch(self, semaphore, endpoint, params):
+        """Run _request off the event loop, bounded by the semaphore; None if skipped after repeated auth failures"""
+        async with semaphore:
+            if self._auth_failures >= MAX_AUTH_FAILURES:
+                return None
+            
+            result = await asyncio.to_thread(
+                self._request, endpoint, params, self.retailer_id, params['pageSize']
+            )
+            
+            # Once any request has succeeded the credentials are good, and a 401/403 only
+            # means this resource isn't permitted. Counted on the event loop, so
+            # concurrent probes don't race on it.
+            status = result[0]
+            if status == 200:
+                self._auth_ok = True
+            elif status in (401, 403) and not self._auth_ok:
+                self._auth_failures += 1
+            return result
+    
+    async def test_endpoints(self):
         """Test various GET endpoints to see available data"""
         endpoints_to_test = [
             ('/categories', 'Categories'),  # Start with categories as mentioned in docs
@@ -141,33 +242,47 @@ class KiotVietAPI:
         
         results = {}
         
-        # Try common retailer names in case one works
-        potential_retailers = [None, 'taphoaxyz', 'store', 'shop', self.client_id[:10]]
+        # Resolve the retailer once instead of re-probing it for every endpoint
+        self._auth_failures = 0
+        self._auth_ok = self._discover_retailer()
+        
+        # Add pagination parameters
+        params = {
+            'pageSize': 5,  # Small page size for testing
+            'currentItem': 0
+        }
         
-        for endpoint, name in endpoints_to_test:
+        # Probe all endpoints concurrently. The KiotViet public API has no $batch or
+        # multi-resource endpoint, so each resource still needs its own GET; the shared
+        # session keeps these on warm connections instead.
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        responses = await asyncio.gather(
+            *[self._fetch(semaphore, endpoint, params) for endpoint, _ in endpoints_to_test],
+            return_exceptions=True
+        )
+        if self._auth_failures >= MAX_AUTH_FAILURES:
+            print("❌ Auth rejected twice — skipped the remaining endpoints")
+        
+        # Report in endpoint order once every probe has finished
+        for (endpoint, name), result in zip(endpoints_to_test, responses):
             print(f"\n{'='*50}")
             print(f"Testing {name} endpoint: {endpoint}")
             print('='*50)
             
-            # Add pagination parameters
-            params = {
-                'pageSize': 5,  # Small page size for testing
-                'currentItem': 0
-            }
-            
-            # Try without retailer first, then with potential retailer names
-            data = None
-            for retailer in potential_retailers:
-                print(f"\n--- Trying {'without retailer' if not retailer else f'with retailer: {retailer}'} ---")
-                data = self.make_request(endpoint, params, retailer)
-                if data:
-                    break
+            if isinstance(result, Exception):
+                print(f"❌ Error while testing {name}: {result}")
+                continue
+            if result is None:
+                print(f"❌ Skipped {name}: authentication was rejected")
+                continue
             
+            status, data, error = result
+            self._report_request(endpoint, self.retailer_id, status, error)
             if data:
                 results[name] = data
                 self.analyze_response(name, data)
             else:
-                print(f"❌ No data retrieved for {name} with any retailer option")
+                print(f"❌ No data retrieved for {name}")
                 
         return results
     
@@ -185,7 +300,8 @@ class KiotVietAPI:
                 if data['data'] and len(data['data']) > 0:
                     print("Sample item keys:", list(data['data'][0].keys()) if isinstance(data['data'][0], dict) else "Not a dict")
                     print("Sample item:")
-                    print(json.dumps(data['data'][0], indent=2, ensure_ascii=False)[:500] + "..." if len(str(data['data'][0])) > 500 else json.dumps(data['data'][0], indent=2, ensure_ascii=False))
+                    rendered = orjson.dumps(data['data'][0], option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+                    print(rendered[:500] + ("..." if len(rendered) > 500 else ""))
             
             # Print other relevant fields
             for key in ['total', 'pageSize', 'currentItem']:
@@ -199,7 +315,7 @@ class KiotVietAPI:
         
         print()
 
-def main():
+async def main():
     print("🚀 KiotViet API Testing Script")
     print("=" * 50)
     
@@ -212,7 +328,7 @@ def main():
     
     # Test endpoints
     print("\n🔍 Testing available endpoints...")
-    results = api.test_endpoints()
+    results = await api.test_endpoints()
     
     # Summary
     print("\n" + "="*50)
@@ -257,4 +373,4 @@ def main():
         print("⚠️ No data available for dashboard creation. Check API access permissions.")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
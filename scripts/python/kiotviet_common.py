@@ -0,0 +1,213 @@
+"""
+Shared helpers for the KiotViet API test scripts
+HTTP session setup, access token caching and response parsing
+"""
+
+import json
+import os
+import threading
+import time
+
+import ijson
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Access tokens are reused across runs until shortly before they expire
+TOKEN_CACHE_PATH = os.path.expanduser('~/.cache/kiotviet/token.json')
+
+# Cap on in-flight API requests, to stay within KiotViet rate limits
+MAX_CONCURRENT_REQUESTS = 5
+
+# Bodies up to this declared size are parsed in one go with orjson; larger or unsized
+# (chunked) bodies are stream-parsed so an ignored pageSize can't exhaust memory
+STREAM_THRESHOLD_BYTES = 1024 * 1024
+
+# Longest single wait between retries, including server-sent Retry-After values
+RETRY_BACKOFF_MAX = 30
+
+
+class _CappedRetry(Retry):
+    """Retry policy that honours Retry-After but never sleeps longer than RETRY_BACKOFF_MAX"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_BACKOFF_MAX)
+
+
+def build_session():
+    """Create the shared HTTP session used for every KiotViet request"""
+    session = requests.Session()
+
+    # Retry transient failures (rate limiting, 5xx, dropped connections) with jittered
+    # exponential backoff; 400/401/403 are not retried so bad credentials fail fast
+    retries = _CappedRetry(
+        total=3,
+        backoff_factor=1,
+        backoff_max=RETRY_BACKOFF_MAX,
+        backoff_jitter=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'POST'],
+        raise_on_status=False
+    )
+    # Keep as many connections per host as there can be concurrent probes
+    session.mount('https://', HTTPAdapter(
+        pool_connections=2,  # id.kiotviet.vn + public.kiotapi.com
+        pool_maxsize=MAX_CONCURRENT_REQUESTS,
+        max_retries=retries
+    ))
+    return session
+
+
+def parse_json(response):
+    """Parse a response body with orjson instead of the stdlib json module"""
+    return orjson.loads(response.content)
+
+
+def read_page(response, max_items):
+    """Parse a page response, bounding memory only when the body could be unbounded.
+
+    With a Content-Length up to STREAM_THRESHOLD_BYTES the body is parsed with orjson as
+    is; otherwise it is stream-parsed and truncated to max_items entries of 'data'.
+    """
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) <= STREAM_THRESHOLD_BYTES:
+        return parse_json(response)
+    return _stream_page(response, max_items)
+
+
+def _stream_page(response, max_items):
+    """Stream-parse a response body, keeping at most max_items entries of a top-level 'data' array.
+
+    Everything else is returned exactly as the server sent it. Items past the limit are
+    parsed and dropped rather than built, so memory stays bounded even if the server
+    ignores pageSize, and the connection is still drained for reuse.
+    """
+    response.raw.decode_content = True
+    builder = ijson.ObjectBuilder()
+    in_data = False
+    seen_items = 0
+    depth = 0
+    skipping = False
+    try:
+        for prefix, event, value in ijson.parse(response.raw, use_float=True):
+            if prefix == 'data' and event in ('start_array', 'end_array'):
+                in_data = event == 'start_array'
+            elif in_data and (prefix == 'data.item' or prefix.startswith('data.item.')):
+                # At depth 0 every event starts a new item
+                if depth == 0:
+                    skipping = seen_items >= max_items
+                    seen_items += 1
+                if event in ('start_map', 'start_array'):
+                    depth += 1
+                elif event in ('end_map', 'end_array'):
+                    depth -= 1
+                if skipping:
+                    continue
+            builder.event(event, value)
+    finally:
+        response.close()
+    return builder.value
+
+
+def _is_token_rejection(response):
+    """Whether a response rejects the bearer token itself.
+
+    A missing or wrong Retailer header can also produce a 401, so only the RFC 6750
+    invalid_token challenge counts as the token being revoked or expired.
+    """
+    return (response.status_code == 401
+            and 'invalid_token' in response.headers.get('WWW-Authenticate', ''))
+
+
+class KiotVietClient:
+    """Base for the test scripts: shared session and access token handling.
+
+    Subclasses set client_id and secret_key after calling __init__.
+    """
+
+    def __init__(self):
+        self.base_url = "https://public.kiotapi.com"
+        self.access_token = None
+        self._token_from_cache = False
+        self._reauth_lock = threading.Lock()
+
+        # Shared session keeps the HTTPS connection to the API warm across requests
+        self.session = build_session()
+
+    def _load_cached_token(self):
+        """Return the cached access token for this client if it has not expired"""
+        try:
+            with open(TOKEN_CACHE_PATH) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if cached.get('client_id') == self.client_id and time.time() < cached.get('expires_at', 0) - 60:
+            return cached.get('access_token')
+        return None
+
+    def _use_cached_token(self):
+        """Install the cached access token if there is a valid one"""
+        cached_token = self._load_cached_token()
+        if not cached_token:
+            return False
+        self._set_access_token(cached_token)
+        self._token_from_cache = True
+        return True
+
+    def _save_token(self, expires_in):
+        """Persist the access token so later runs can skip authentication"""
+        if not expires_in:
+            return
+        try:
+            os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+            fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'client_id': self.client_id,
+                    'access_token': self.access_token,
+                    'expires_at': time.time() + expires_in
+                }, f)
+            os.chmod(TOKEN_CACHE_PATH, 0o600)
+        except OSError as e:
+            print(f"⚠️ Could not cache access token: {e}")
+
+    def _clear_cached_token(self):
+        """Delete the token cache file"""
+        try:
+            os.remove(TOKEN_CACHE_PATH)
+        except OSError:
+            pass
+
+    def _set_access_token(self, access_token):
+        """Store the token and attach the static auth headers to the shared session once"""
+        self.access_token = access_token
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        })
+
+    def _refresh_rejected_token(self, rejected_token):
+        """After a 401, replace a cached token with a fresh one (once); return whether to retry"""
+        with self._reauth_lock:
+            if self.access_token != rejected_token:
+                # Another request already refreshed it
+                return True
+            if not self._token_from_cache:
+                return False
+
+            print("⚠️ Cached access token was rejected, re-authenticating")
+            self._token_from_cache = False
+            self._clear_cached_token()
+            return self.authenticate()
+
+    def _get(self, url, **kwargs):
+        """GET on the shared session, retrying once with a fresh token if a cached one is rejected"""
+        token = self.access_token
+        response = self.session.get(url, **kwargs)
+        if _is_token_rejection(response) and self._refresh_rejected_token(token):
+            response.close()
+            response = self.session.get(url, **kwargs)
+        return response